@@ -17,7 +17,8 @@ class ClusterManager:
                                        between servers.
   """
 
-  def __init__(self, topology: dict[ServerInfo, set[ServerInfo]], master_name: str, sock_pool_size: int):
+  def __init__(self, topology: dict[ServerInfo, set[ServerInfo]], master_name: str, sock_pool_size: int,
+               multiplexed: bool = False):
     self._logger = server_logger.bind(server_name="CLUSTER_MANAGER")
 
     self._server_infos: dict[str, ServerInfo] = {}
@@ -36,7 +37,7 @@ class ClusterManager:
 
     self._servers = {}
     for si in self._server_infos.values():
-      connection_stub = ConnectionStub(self._topology[si], sock_pool_size)
+      connection_stub = ConnectionStub(self._topology[si], sock_pool_size, multiplexed)
       self._servers[si.name] = self.create_server(si, connection_stub)
 
     self._logger.debug(
@@ -70,7 +70,8 @@ class TestCR(unittest.TestCase):
 
     def setter(c: CrClient, name: str) -> None:
       logger_instance = client_logger.bind(server_name=name)
-      start_time = time.time()
+      test_duration = self.test_duration
+      start_time = time.monotonic()
       sets = 0
       while True:
         logger_instance.info(f"Setting key = {sets}")
@@ -78,15 +79,15 @@ class TestCR(unittest.TestCase):
         logger_instance.info(f"Set key = {sets}")
         sets += 1
         # Check if the time window has elapsed
-        if time.time() - start_time >= self.test_duration:
+        if time.monotonic() - start_time >= test_duration:
           break
-        time.sleep(0.1)
       with self.lock:
         self.total_sets += sets
 
     def getter(c: CrClient, name: str) -> None:
       logger_instance = client_logger.bind(server_name=name)
-      start_time = time.time()
+      test_duration = self.test_duration
+      start_time = time.monotonic()
       gets = 0
       while True:
         logger_instance.info(f"Getting key")
@@ -95,7 +96,7 @@ class TestCR(unittest.TestCase):
         logger_instance.info(f"Get key = {val}")
         gets += 1
         # Check if the time window has elapsed
-        if time.time() - start_time >= self.test_duration:
+        if time.monotonic() - start_time >= test_duration:
           break
       with self.lock:
         self.total_gets += gets
@@ -1,47 +1,87 @@
+import heapq
 import random
 import time
 from typing import Optional, Final, List
 
-from craq.craq_server import CraqServer
+from craq.craq_server import CraqServer, GET_OP, SET_OP
 from core.cluster import ClusterManager
 from core.message import JsonMessage, JsonMessage
-from core.network import TcpClient, ConnectionStub
+from core.network import PipelinedTcpClient, ConnectionStub
 from core.server import ServerInfo, Server
 from collections import defaultdict
 
 
-POOL_SZ = 32
+POOL_SZ = 1  # Blocking RPCs to a neighbour are multiplexed over one connection
 
 class CraqClient:
+    """Not thread-safe: each worker thread should `connect()` its own client."""
+
     def __init__(self, infos: list[ServerInfo]) -> None:
-        self.conns: list[TcpClient] = []
+        self.conns: list[PipelinedTcpClient] = []
         for info in infos:
-            conn = TcpClient(info, True, 1)
+            conn = PipelinedTcpClient(info)
             self.conns.append(conn)
-        self.response_times: dict[TcpClient, float] = {conn: 0.0 for conn in self.conns}
+        # EMA of response time per connection index, and a min-heap of
+        # (latency, index) so picking the fastest server is O(log N). An entry
+        # is current only while its latency matches `_latencies[index]`.
+        # Integer nanoseconds keep the per-GET update free of float boxing.
+        self._latencies: list[int] = [0] * len(self.conns)
+        self._by_latency: list[tuple[int, int]] = [(0, i) for i in range(len(self.conns))]
 
         
     def set(self, key: str, val: str) -> bool:
-          response: Optional[JsonMessage] = self.conns[0].send(JsonMessage({"type": "SET", "key": key, "val": val}))
+          response: Optional[JsonMessage] = self.conns[0].send(JsonMessage({"op": SET_OP, "key": key, "val": val}))
           assert response is not None
           return response["status"] == "OK"
         
     def get(self, key: str) -> tuple[bool, Optional[str]]:
-        # server = self._get_random_server()
-        server = self._get_least_loaded_server()
-        start_time = time.time()
-        response: Optional[JsonMessage] = server.send(JsonMessage({"type": "GET", "key": key}))
+        idx = self._get_least_loaded_server()
+        start_ns = time.monotonic_ns()
+        try:
+            response: Optional[JsonMessage] = self.conns[idx].send(JsonMessage({"op": GET_OP, "key": key}))
+        finally:
+            self._record_response_time(idx, time.monotonic_ns() - start_ns)
         assert response is not None
-        elapsed_time = time.time() - start_time
-        self.response_times[server] = elapsed_time * 0.3 + self.response_times[server] * 0.7
         if response["status"] == "OK":
           return True, response["val"]
         return False, None
+
+    def close(self) -> None:
+        for conn in self.conns:
+            conn.close()
+
+    def get_many(self, keys: list[str]) -> list[tuple[bool, Optional[str]]]:
+        """Pipeline GETs for all keys to one server in a single batch."""
+        if not keys:
+            return []
+        idx = self._get_least_loaded_server()
+        start_ns = time.monotonic_ns()
+        try:
+            responses = self.conns[idx].send_many([JsonMessage({"op": GET_OP, "key": key}) for key in keys])
+        finally:
+            self._record_response_time(idx, (time.monotonic_ns() - start_ns) // len(keys))
+        return [(True, response["val"]) if response["status"] == "OK" else (False, None)
+                for response in responses]
     
-    def _get_least_loaded_server(self) -> TcpClient:
-        return min(self.response_times, key=self.response_times.get)
+    def _get_least_loaded_server(self) -> int:
+        """Peek at the fastest connection; it stays in the heap while in use."""
+        by_latency = self._by_latency
+        # Entries are never removed on update, so skip the outdated ones on top
+        while by_latency[0][0] != self._latencies[by_latency[0][1]]:
+            heapq.heappop(by_latency)
+        return by_latency[0][1]
+
+    def _record_response_time(self, idx: int, elapsed_ns: int) -> None:
+        latency = (elapsed_ns * 3 + self._latencies[idx] * 7) // 10
+        self._latencies[idx] = latency
+        if len(self._by_latency) > 4 * len(self._latencies):
+            # Drop the outdated entries that never reached the top
+            self._by_latency = [(lat, i) for i, lat in enumerate(self._latencies)]
+            heapq.heapify(self._by_latency)
+        else:
+            heapq.heappush(self._by_latency, (latency, idx))
 
-    def _get_random_server(self) -> TcpClient:
+    def _get_random_server(self) -> PipelinedTcpClient:
         server = random.choice(self.conns)
         return server
 
@@ -52,18 +92,8 @@ class CraqCluster(ClusterManager):
     self.c = ServerInfo("c", "localhost", 9902)
     self.d = ServerInfo("d", "localhost", 9903)
 
-    self.prev: dict[ServerInfo, Optional[ServerInfo]] = {
-      self.a: None,
-      self.b: self.a,
-      self.c: self.b,
-      self.d: self.c,
-    }
-    self.next: dict[ServerInfo, Optional[ServerInfo]] = {
-      self.a: self.b,
-      self.b: self.c,
-      self.c: self.d,
-      self.d: None,
-    }
+    # Chain order, head first; a server's neighbours are found by index
+    self.chain: tuple[ServerInfo, ...] = (self.a, self.b, self.c, self.d)
 
     super().__init__(
       master_name="d",
@@ -72,11 +102,15 @@ class CraqCluster(ClusterManager):
                 self.c: {self.d},
                 self.d: set()},
       sock_pool_size=POOL_SZ,
+      multiplexed=True,
     )
 
   def connect(self, craq: bool = False) -> CraqClient:
-    return CraqClient([self.a, self.b, self.c, self.d])
+    return CraqClient(list(self.chain))
 
   def create_server(self, si: ServerInfo, connection_stub: ConnectionStub) -> Server:
+    i = self.chain.index(si)
+    prev = self.chain[i - 1] if i > 0 else None
+    next = self.chain[i + 1] if i < len(self.chain) - 1 else None
     return CraqServer(info=si, connection_stub=connection_stub,
-                      next=self.next[si], prev=self.prev[si], tail=self.d)
+                      next=next, prev=prev, tail=self.chain[-1])
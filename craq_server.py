@@ -1,82 +1,134 @@
 import json
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
-from typing import Optional, Final
+from queue import Empty, SimpleQueue
+from typing import Callable, Collection, Iterator, Optional, Final
 from threading import Lock
-from collections import defaultdict
 
-from core.logger import server_logger
 from core.message import JsonMessage, JsonMessage
 from core.network import ConnectionStub
-from core.server import Server, ServerInfo
+from core.server import MAX_WORKERS, Server, ServerInfo
 import threading
         
 
 class RequestType(Enum):
+    """Sent on the wire as the integer `op` field of a request."""
     SET = 1
     GET = 2
     QUERY = 3
+    SET_BATCH = 4
 
 
-class KVGetRequest:
-  def __init__(self, msg: JsonMessage):
-    self._json_message = msg
-    assert "key" in self._json_message, self._json_message
+# Resolved once; these are built into messages on the request path
+SET_OP: Final[int] = RequestType.SET.value
+GET_OP: Final[int] = RequestType.GET.value
+QUERY_OP: Final[int] = RequestType.QUERY.value
+SET_BATCH_OP: Final[int] = RequestType.SET_BATCH.value
 
-  @property
-  def key(self) -> str:
-    return self._json_message["key"]
+# Shared, never modified responses; their encoding is cached after first use
+_OK: Final[JsonMessage] = JsonMessage({"status": "OK"})
+_NOT_FOUND: Final[JsonMessage] = JsonMessage({"status": "Key not found"})
 
-  @property
-  def json_msg(self) -> JsonMessage:
-    return self._json_message
+LOCK_STRIPES = 1024  # Must be a power of two
+BATCH_MAX_OPS = 64  # Max SETs coalesced into one downstream SET_BATCH
+BATCH_WINDOW_S = 0.0002  # How long the sender waits for more SETs to coalesce
 
 
-class KVQueryRequest:
-  def __init__(self, msg: JsonMessage):
-    self._json_message = msg
-    assert "key" in self._json_message, self._json_message
+class RWLock:
+  """Reader-writer lock. Any number of readers may hold it at once; a writer
+  holds it exclusively. Waiting writers block new readers so SETs are not starved."""
 
-  @property
-  def key(self) -> str:
-    return self._json_message["key"]
+  def __init__(self) -> None:
+    self._cond = threading.Condition(Lock())
+    self._readers = 0
+    self._writer = False
+    self._writers_waiting = 0
 
-  @property
-  def json_msg(self) -> JsonMessage:
-    return self._json_message
+  @contextmanager
+  def read_locked(self) -> Iterator[None]:
+    with self._cond:
+      while self._writer or self._writers_waiting:
+        self._cond.wait()
+      self._readers += 1
+    try:
+      yield
+    finally:
+      with self._cond:
+        self._readers -= 1
+        if self._readers == 0:
+          self._cond.notify_all()
 
+  @contextmanager
+  def write_locked(self) -> Iterator[None]:
+    with self._cond:
+      self._writers_waiting += 1
+      while self._writer or self._readers:
+        self._cond.wait()
+      self._writers_waiting -= 1
+      self._writer = True
+    try:
+      yield
+    finally:
+      with self._cond:
+        self._writer = False
+        self._cond.notify_all()
 
-class KVSetRequest:
-  def __init__(self, msg: JsonMessage):
-    self._json_message = msg
-    assert "key" in self._json_message, self._json_message
-    assert "val" in self._json_message, self._json_message
 
-  @property
-  def key(self) -> str:
-    return self._json_message["key"]
+class PendingVersions:
+  """Versions of one key staged while a SET propagates down the chain, kept as
+  parallel lists sorted by version. Every SET removes its own version once
+  propagation finishes, so the lists only hold SETs still in flight."""
 
-  @property
-  def val(self) -> str:
-    return self._json_message["val"]
+  __slots__ = ("vers", "vals")
 
-  @property
-  def version(self) -> Optional[int]:
-    return self._json_message.get("ver")
+  def __init__(self, vers: Optional[list[int]] = None, vals: Optional[list[str]] = None) -> None:
+    self.vers: list[int] = [] if vers is None else vers
+    self.vals: list[str] = [] if vals is None else vals
 
-  @version.setter
-  def version(self, ver: int) -> None:
-    self._json_message['ver'] = ver
+  def add(self, ver: int, val: str) -> None:
+    # The head stages versions in order; downstream they can arrive out of order
+    if not self.vers or self.vers[-1] < ver:
+      self.vers.append(ver)
+      self.vals.append(val)
+    else:
+      idx = bisect_left(self.vers, ver)
+      self.vers.insert(idx, ver)
+      self.vals.insert(idx, val)
 
-  @property
-  def json_msg(self) -> JsonMessage:
-    return self._json_message
+  def get(self, ver: Optional[int]) -> Optional[str]:
+    if ver is None:
+      return None
+    idx = bisect_left(self.vers, ver)
+    if idx < len(self.vers) and self.vers[idx] == ver:
+      return self.vals[idx]
+    return None
 
-  def __str__(self) -> str:
-    return str(self._json_message)
+  def remove(self, ver: int) -> None:
+    idx = bisect_left(self.vers, ver)
+    if idx < len(self.vers) and self.vers[idx] == ver:
+      del self.vers[idx]
+      del self.vals[idx]
 
+  def copy(self) -> "PendingVersions":
+    return PendingVersions(self.vers.copy(), self.vals.copy())
+
+  def __len__(self) -> int:
+    return len(self.vers)
+
+
+class PropagationWaiter:
+  """A SET queued for the propagation thread; `ok` is valid once `done` is set."""
+
+  __slots__ = ("msg", "done", "ok")
+
+  def __init__(self, msg: JsonMessage) -> None:
+    self.msg = msg
+    self.done = threading.Event()
+    self.ok = False
 
-from threading import Lock
-from collections import defaultdict
 
 class CraqServer(Server):
     """CRAQ server with key-level locking. Supports concurrent read while writes are in progress."""
@@ -88,72 +140,170 @@ class CraqServer(Server):
         self.next: Final[Optional[str]] = None if next is None else next.name
         self.prev: Final[Optional[str]] = None if prev is None else prev.name
         self.tail: Final[str] = tail.name
-        self.temp_store: dict[str, dict[int, str]] = {}
+        self.temp_store: dict[str, PendingVersions] = {}
         self.store: dict[str, tuple[int, str]] = {} 
-        self.locks: defaultdict[str, Lock] = defaultdict(Lock)
+        # Head only: last version issued per key. It never moves back, so the
+        # version of a failed SET, possibly applied further down, is not reused.
+        self._issued_versions: dict[str, int] = {}
+        self.locks: list[RWLock] = [RWLock() for _ in range(LOCK_STRIPES)]
+        # Handlers indexed by opcode (RequestType value)
+        self._handlers: tuple[Optional[Callable[[JsonMessage], JsonMessage]], ...] = (
+            None, self._set, self._get, self._query, self._set_batch)
+        assert all(self._handlers[t.value] is not None for t in RequestType)
+        # SETs waiting to be coalesced and sent to `next` by the propagation thread
+        self._propagation_queue: SimpleQueue[PropagationWaiter] = SimpleQueue()
+        self._batch_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+    def run(self) -> None:
+        if self.next is not None:
+            threading.Thread(target=self._propagation_loop, daemon=True, name="propagate").start()
+        super().run()
+
+    def _lock_for(self, key: str) -> RWLock:
+        return self.locks[hash(key) & (LOCK_STRIPES - 1)]
 
     def _process_req(self, msg: JsonMessage) -> JsonMessage:
-        if msg.get("type") == RequestType.GET.name:
-            return self._get(KVGetRequest(msg))
-        elif msg.get("type") == RequestType.SET.name:
-            return self._set(KVSetRequest(msg))
-        elif msg.get("type") == RequestType.QUERY.name:
-            return self._query(KVQueryRequest(msg))
-        else:
-            server_logger.critical("Invalid message type")
+        op = msg.get("op")
+        handler = self._handlers[op] if type(op) is int and 0 <= op < len(self._handlers) else None
+        if handler is None:
+            self._logger.critical("Invalid message type")
             return JsonMessage({"status": "Unexpected type"})
+        assert "key" in msg or op == SET_BATCH_OP, msg
+        return handler(msg)
 
-    def _get(self, req: KVGetRequest) -> JsonMessage:
-        _logger = server_logger.bind(server_name=self._info.name)
-        _logger.debug(f"GET request for key: {req.key}")
-        with self.locks[req.key]:
-            if req.key in self.temp_store and self.temp_store[req.key]:
-                query_msg = JsonMessage({"type": RequestType.QUERY.name, "key": req.key})
-                response = self._connection_stub.send(from_=self._info.name, to=self.next, message=query_msg)
-                tail_committed_version = response.get("ver")
-                temp_versions_dict = self.temp_store[req.key]
-                if tail_committed_version in temp_versions_dict:
-                   return JsonMessage({"status": "OK", 
-                                       "val": temp_versions_dict[tail_committed_version]})
-                elif req.key in self.store:
-                    _, val = self.store[req.key]
-                    return JsonMessage({"status": "OK", "val": val})
-            elif req.key in self.store:
-                _, val = self.store[req.key]
-                return JsonMessage({"status": "OK", "val": val})
-        return JsonMessage({"status": "Key not found"})
-
-    def _query(self, req: KVQueryRequest) -> JsonMessage:
-        _logger = server_logger.bind(server_name=self._info.name)
-        _logger.debug(f"QUERY request for key: {req.key}")
-        with self.locks[req.key]:
-            if self.next is None:
-                ver, _ = self.store[req.key]
-                return JsonMessage({"ver": ver})
-            else:
-                return self._connection_stub.send(from_=self._info.name, to=self.next, message=req.json_msg)
-
-    def _set(self, req: KVSetRequest) -> JsonMessage:
-        _logger = server_logger.bind(server_name=self._info.name)
-        _logger.debug(f"SET request for key: {req.key} with value: {req.val}")
-        with self.locks[req.key]:
+    def _get(self, msg: JsonMessage) -> JsonMessage:
+        key = msg["key"]
+        # `store` entries are immutable (version, value) tuples that `_commit`
+        # swaps in with a single assignment, so they are read without the lock.
+        # `_set` commits to `store` before it drops the staged version, so
+        # `temp_store` must be read first: if nothing is staged at that point,
+        # `store` already holds every version the tail had committed by then.
+        store = self.store
+        pending = self.temp_store.get(key)
+        committed = store.get(key)
+        if not pending:
+            return self._committed_response(committed)
+
+        lock = self._lock_for(key)
+        with lock.read_locked():
+            pending = self.temp_store.get(key)
+            pending = PendingVersions() if pending is None else pending.copy()
+        committed = store.get(key)
+        if not pending:
+            # The write committed while we were waiting for the lock
+            return self._committed_response(committed)
+
+        # Dirty read: ask the tail which version is committed. The lock is not
+        # held across the RPC so that writers on this key are not stalled.
+        query_msg = JsonMessage({"op": QUERY_OP, "key": key})
+        response = self._connection_stub.send(from_=self._info.name, to=self.next, message=query_msg)
+        tail_committed_version = response.get("ver")
+        val = pending.get(tail_committed_version)
+        if val is not None:
+            return JsonMessage({"status": "OK", "val": val})
+
+        # The tail may have committed a version staged after the snapshot was taken
+        with lock.read_locked():
+            latest_pending = self.temp_store.get(key)
+            val = None if latest_pending is None else latest_pending.get(tail_committed_version)
+        if val is not None:
+            return JsonMessage({"status": "OK", "val": val})
+        committed = store.get(key) or committed
+        return self._committed_response(committed)
+
+    @staticmethod
+    def _committed_response(committed: Optional[tuple[int, str]]) -> JsonMessage:
+        if committed is None:
+            return _NOT_FOUND
+        return JsonMessage({"status": "OK", "val": committed[1]})
+
+    def _query(self, msg: JsonMessage) -> JsonMessage:
+        if self.next is not None:
+            return self._connection_stub.send(from_=self._info.name, to=self.next, message=msg)
+        ver, _ = self.store[msg["key"]]
+        return JsonMessage({"ver": ver})
+
+    def _set(self, msg: JsonMessage) -> JsonMessage:
+        key, val = msg["key"], msg["val"]
+        # Arguments are only formatted if DEBUG is enabled for the server sink
+        self._logger.debug("SET request for key: {} with value: {}", key, val)
+        lock = self._lock_for(key)
+        with lock.write_locked():
             if self.prev is None:
-                if req.key in self.temp_store and self.temp_store[req.key]:
-                    current_version = max(self.temp_store[req.key].keys())
-                elif req.key in self.store:
-                    current_version, _ = self.store[req.key]
+                ver = self._issued_versions.get(key, 0) + 1
+                self._issued_versions[key] = ver
+                msg["ver"] = ver
+            ver = msg["ver"]
+
+            if self.next is None:
+                self._commit(key, ver, val)
+                return _OK
+
+            # Stage the dirty version; concurrent GETs resolve it through a QUERY
+            if key not in self.temp_store:
+                self.temp_store[key] = PendingVersions()
+            self.temp_store[key].add(ver, val)
+
+        # Propagate without holding the lock so writes to the key can pipeline
+        propagated = self._propagate(msg)
+
+        with lock.write_locked():
+            if propagated:
+                self._commit(key, ver, val)
+            self.temp_store[key].remove(ver)
+        if not propagated:
+            # The rest of the chain did not apply it, so neither does this node
+            return JsonMessage({"status": "Propagation failed"})
+        return _OK
+
+    def _set_batch(self, msg: JsonMessage) -> JsonMessage:
+        results = self._batch_pool.map(lambda op: self._set(JsonMessage(op)), msg["ops"])
+        failed = [i for i, result in enumerate(results) if result["status"] != "OK"]
+        if not failed:
+            return _OK
+        # Report which ops failed so that the others still commit upstream
+        return JsonMessage({"status": "Batch failed", "failed": failed})
+
+    def _propagate(self, msg: JsonMessage) -> bool:
+        """Hand the SET to the propagation thread and wait for `next` to apply it.
+        Returns whether it was applied down the rest of the chain."""
+        waiter = PropagationWaiter(msg)
+        self._propagation_queue.put(waiter)
+        waiter.done.wait()
+        return waiter.ok
+
+    def _propagation_loop(self) -> None:
+        queue = self._propagation_queue
+        while True:
+            batch = [queue.get()]
+            deadline = time.monotonic() + BATCH_WINDOW_S
+            while len(batch) < BATCH_MAX_OPS:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(queue.get(timeout=timeout) if timeout > 0 else queue.get_nowait())
+                except Empty:
+                    break
+
+            ops = [{"key": w.msg["key"], "val": w.msg["val"], "ver": w.msg["ver"]} for w in batch]
+            failed: Collection[int] = range(len(batch))
+            try:
+                response = self._connection_stub.send(from_=self._info.name, to=self.next,
+                                                      message=JsonMessage({"op": SET_BATCH_OP, "ops": ops}))
+                if response is not None and response.get("status") == "OK":
+                    failed = ()
                 else:
-                    current_version = 0
-                req.version = current_version + 1
-
-            if self.next is not None:
-                if req.key not in self.temp_store:
-                    self.temp_store[req.key] = {}
-                self.temp_store[req.key][req.version] = req.val
-                self._connection_stub.send(from_=self._info.name, to=self.next, message=req.json_msg)
-                self.store[req.key] = (req.version, req.val)
-                del self.temp_store[req.key][req.version]
-                return JsonMessage({"status": "OK"})
-            else:
-                self.store[req.key] = (req.version, req.val)
-                return JsonMessage({"status": "OK"})
+                    self._logger.critical("SET_BATCH to {} failed: {}", self.next, response)
+                    if response is not None and "failed" in response:
+                        failed = set(response["failed"])
+            except Exception as e:
+                self._logger.exception(e)
+            finally:
+                for i, waiter in enumerate(batch):
+                    waiter.ok = i not in failed
+                    waiter.done.set()
+
+    def _commit(self, key: str, ver: int, val: str) -> None:
+        # Pipelined writes may be acknowledged out of order; never regress a version
+        committed = self.store.get(key)
+        if committed is None or committed[0] < ver:
+            self.store[key] = (ver, val)
@@ -55,6 +55,16 @@ class TestCRAQ(unittest.TestCase):
     finally:
       remove_client_logfile(file_sink_id)
 
+  def test_get_many(self) -> None:
+    client = self.craq.connect()
+    for i in range(10):
+      self.assertTrue(client.set(f"key{i}", f"{i}"))
+
+    results = client.get_many([f"key{i}" for i in range(10)] + ["missing"])
+    self.assertEqual(results[:10], [(True, f"{i}") for i in range(10)])
+    self.assertEqual(results[10], (False, None))
+    client.close()
+
   def test_throughput(self) -> None:
     # Redirect the logs to a file
     logfile_name = f"logs/{self._testMethodName}.log"
@@ -70,7 +80,8 @@ class TestCRAQ(unittest.TestCase):
 
     def setter(c: CraqClient, name: str) -> None:
       logger_instance = client_logger.bind(server_name=name)
-      start_time = time.time()
+      test_duration = self.test_duration
+      start_time = time.monotonic()
       sets = 0
       while True:
         logger_instance.info(f"Setting key = {sets}")
@@ -78,15 +89,15 @@ class TestCRAQ(unittest.TestCase):
         logger_instance.info(f"Set key = {sets}")
         sets += 1
         # Check if the time window has elapsed
-        if time.time() - start_time >= self.test_duration:
+        if time.monotonic() - start_time >= test_duration:
           break
-        time.sleep(0.1)
       with self.lock:
         self.total_sets += sets
 
     def getter(c: CraqClient, name: str) -> None:
       logger_instance = client_logger.bind(server_name=name)
-      start_time = time.time()
+      test_duration = self.test_duration
+      start_time = time.monotonic()
       gets = 0
       while True:
         logger_instance.info(f"Getting key")
@@ -95,7 +106,7 @@ class TestCRAQ(unittest.TestCase):
         logger_instance.info(f"Get key = {val}")
         gets += 1
         # Check if the time window has elapsed
-        if time.time() - start_time >= self.test_duration:
+        if time.monotonic() - start_time >= test_duration:
           break
       with self.lock:
         self.total_gets += gets
@@ -1,44 +1,60 @@
 from __future__ import annotations
-import json
+import orjson
 from typing import Final, Any, Optional
 
 
 class JsonMessage:
     def __init__(self, msg: dict) -> None:
         self._msg_d: Final[dict] = msg
+        # Encoded body, cached until the message is modified. Lets shared
+        # response messages skip serialization entirely.
+        self._msg_bytes: Optional[bytes] = None
 
     @staticmethod
     def deserialize(msg: bytes) -> JsonMessage:
-        msg_str = msg.decode("utf-8")
-        msg_json: dict = json.loads(msg_str)
+        msg_json: dict = orjson.loads(msg)
         return JsonMessage(msg=msg_json)
 
     @property
     def msg_bytes(self):
-        return str(self).encode("utf-8")
+        if self._msg_bytes is None:
+            self._msg_bytes = orjson.dumps(self._msg_d)
+        return self._msg_bytes
 
     @property
     def msg_len(self):
         return len(self.msg_bytes)
 
-    def serialize(self) -> bytes:
+    def serialize(self, req_id: Optional[int] = None) -> bytes:
         """
         -------------------------------------------------------------
         | message-length (8-bytes) | message (message-length bytes) |
         -------------------------------------------------------------
         length:- is unsigned is integer.
         message:- is utf-8 encoded
+
+        If `req_id` is given it is added to the encoded message without
+        modifying this one, so shared messages can be tagged concurrently.
         """
-        return self.msg_len.to_bytes(8, "big") + self.msg_bytes
+        if req_id is None:
+            msg_bytes = self.msg_bytes
+        elif "req_id" in self._msg_d:
+            # Splicing would duplicate the key, so encode a tagged copy instead
+            msg_bytes = orjson.dumps({**self._msg_d, "req_id": req_id})
+        else:
+            sep = b"," if self._msg_d else b""
+            msg_bytes = self.msg_bytes[:-1] + sep + b'"req_id":' + str(req_id).encode() + b"}"
+        return len(msg_bytes).to_bytes(8, "big") + msg_bytes
 
     def __str__(self) -> str:
-        return json.dumps(self._msg_d)
+        return self.msg_bytes.decode("utf-8")
 
     def __getitem__(self, key: str) -> Any:
         return self._msg_d[key]
 
     def __setitem__(self, key: str, val: Any) -> None:
         self._msg_d[key] = val
+        self._msg_bytes = None
 
     def __contains__(self, key: str) -> bool:
         return key in self._msg_d 
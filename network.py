@@ -1,5 +1,7 @@
+import itertools
 import socket
-from typing import Optional, Final
+import threading
+from typing import Optional, Final, Union
 
 from core.logger import network_logger
 from core.server import ServerInfo
@@ -55,7 +57,7 @@ class TcpClient:
     try:
 
       client_socket.sendall(message.serialize())
-      self._logger.debug(f"Message sent to server at {self._info.host}:{self._info.port} -> {message}")
+      self._logger.debug("Message sent to server at {}:{} -> {}", self._info.host, self._info.port, message)
 
       if self._blocking:
         err_code, response = recv_message(client_socket)
@@ -74,29 +76,189 @@ class TcpClient:
     self._close_client_sockets()
 
 
+class _PendingResponse:
+  __slots__ = ("event", "response")
+
+  def __init__(self) -> None:
+    self.event = threading.Event()
+    self.response: Optional[JsonMessage] = None
+
+
+class _PipelinedConnection:
+  """
+  One socket of a PipelinedTcpClient together with the requests in flight on
+  it, so that a dead socket only fails its own requests.
+  """
+
+  def __init__(self, sock: socket.socket) -> None:
+    self.sock = sock
+    self.pending: dict[int, _PendingResponse] = {}
+    self.closed = False
+    self._lock = threading.Lock()
+
+  def register(self, req_ids: list[int]) -> Optional[list[_PendingResponse]]:
+    """
+    Register waiters for `req_ids`, or return None if the connection is closed.
+    """
+    waiters = [_PendingResponse() for _ in req_ids]
+    with self._lock:
+      if self.closed:
+        return None
+      self.pending.update(zip(req_ids, waiters))
+    return waiters
+
+  def fail(self, req_ids: Optional[list[int]] = None) -> None:
+    """
+    Fail the given requests, or close the connection and fail all of them.
+    """
+    with self._lock:
+      if req_ids is None:
+        self.closed = True
+        req_ids = list(self.pending)
+      failed = [self.pending.pop(req_id, None) for req_id in req_ids]
+    for pending in failed:
+      if pending is not None:
+        pending.response = JsonMessage({"status": "Connection closed"})
+        pending.event.set()
+
+
+def _receive_responses(conn: _PipelinedConnection, server_name: str) -> None:
+  try:
+    while True:
+      _, response = recv_message(conn.sock)
+      if response is None:
+        break
+      pending = conn.pending.pop(response.get("req_id"), None)
+      if pending is None:
+        network_logger.critical(f"Unexpected response from {server_name}: {response}")
+        continue
+      pending.response = response
+      pending.event.set()
+  except OSError as e:
+    network_logger.debug(f"Connection with {server_name} closed: {e}")
+
+  # Fail everything still in flight on this socket, otherwise the callers would
+  # wait forever; the next send sees `closed` and reconnects
+  conn.fail()
+  conn.sock.close()
+
+
+class PipelinedTcpClient:
+  """
+  A single persistent connection that allows many requests in flight at once.
+  Every request is tagged with a `req_id` that the server echoes back, and a
+  receiver thread hands each response to the caller waiting on that id.
+
+  With `concurrent` set, requests are also marked so that the server may serve
+  them out of order on its worker pool instead of one at a time.
+  """
+
+  def __init__(self, info: ServerInfo, concurrent: bool = False) -> None:
+    self._info = info
+    self._logger = network_logger
+    self._concurrent: Final[bool] = concurrent
+    self._conn: Optional[_PipelinedConnection] = None
+    self._connect_lock = threading.Lock()
+    self._send_lock = threading.Lock()
+    self._req_ids = itertools.count()
+
+  def _connection(self) -> _PipelinedConnection:
+    conn = self._conn
+    if conn is None or conn.closed:
+      with self._connect_lock:
+        conn = self._conn
+        if conn is None or conn.closed:
+          sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+          sock.connect((self._info.host, self._info.port))
+          conn = _PipelinedConnection(sock)
+          receiver = threading.Thread(target=_receive_responses, args=(conn, self._info.name), daemon=True,
+                                      name=f"recv#{self._info.name}")
+          receiver.start()
+          self._logger.debug(f"Created pipelined connection with server "
+                             f"at {self._info.host}:{self._info.port}")
+          self._conn = conn
+    return conn
+
+  def send(self, message: JsonMessage) -> JsonMessage:
+    """
+    Send message to the server and wait for response, then return the response.
+    """
+    return self.send_many([message])[0]
+
+  def send_many(self, messages: list[JsonMessage]) -> list[JsonMessage]:
+    """
+    Write all messages with a single `sendall` and wait for every response.
+    Responses are returned in the order of `messages`.
+    """
+    req_ids: list[int] = []
+    frames: list[bytes] = []
+    for message in messages:
+      req_id = next(self._req_ids)
+      message["req_id"] = req_id
+      if self._concurrent:
+        message["concurrent"] = True
+      req_ids.append(req_id)
+      frames.append(message.serialize())
+
+    waiters: Optional[list[_PendingResponse]] = None
+    try:
+      while waiters is None:
+        conn = self._connection()
+        waiters = conn.register(req_ids)
+      with self._send_lock:
+        conn.sock.sendall(b"".join(frames))
+    except OSError as e:
+      self._logger.exception(e)
+      if waiters is None:
+        return [JsonMessage({"status": "Connection closed"}) for _ in messages]
+      conn.fail(req_ids)
+    self._logger.debug("{} message(s) sent to server at {}:{}", len(frames), self._info.host, self._info.port)
+
+    for pending in waiters:
+      pending.event.wait()
+    return [pending.response for pending in waiters]
+
+  def close(self) -> None:
+    conn, self._conn = self._conn, None
+    if conn is not None:
+      try:
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        conn.sock.close()
+      except OSError as e:
+        self._logger.exception(e)
+
+  def __del__(self):
+    self.close()
+
+
 class ConnectionStub:
-  def __init__(self, connections: set[ServerInfo], sock_pool_sz: int) -> None:
+  def __init__(self, connections: set[ServerInfo], sock_pool_sz: int, multiplexed: bool = False) -> None:
     self._connections: dict[str, ServerInfo] = {}
     for si in connections:
       self._connections[si.name] = si
-    self._blocking_clients: dict[str, TcpClient] = {}
+    self._blocking_clients: dict[str, Union[PipelinedTcpClient, TcpClient]] = {}
     self._non_blocking_clients: dict[str, TcpClient] = {}
     self._sock_pool_sz: Final[int] = sock_pool_sz
+    self._multiplexed: Final[bool] = multiplexed
 
   def initalize_connections(self):
     for connection in self._connections.values():
-      self._blocking_clients[connection.name] = TcpClient(connection, sock_pool_sz=self._sock_pool_sz)
+      if self._multiplexed:
+        # Blocking requests to a peer share one multiplexed connection
+        self._blocking_clients[connection.name] = PipelinedTcpClient(connection, concurrent=True)
+      else:
+        self._blocking_clients[connection.name] = TcpClient(connection, sock_pool_sz=self._sock_pool_sz)
       self._non_blocking_clients[connection.name] = TcpClient(connection, blocking=False, sock_pool_sz=self._sock_pool_sz)
 
-  def get_connection(self, to: str, blocking: bool = True) -> TcpClient:
+  def get_connection(self, to: str, blocking: bool = True) -> Union[PipelinedTcpClient, TcpClient]:
     if blocking:
       return self._blocking_clients[to]
     return self._non_blocking_clients[to]
 
   def send(self, from_: str, to: str, message: JsonMessage, blocking: bool = True) -> JsonMessage:
-    network_logger.debug(f"Sending Message from {from_} to {to}: {message}")
+    network_logger.debug("Sending Message from {} to {}: {}", from_, to, message)
 
-    channel: TcpClient
+    channel: Union[PipelinedTcpClient, TcpClient]
     if not blocking:
       assert to in self._non_blocking_clients, f"Connection {to} doesn't exist in {from_} {self._non_blocking_clients}"
       channel = self._non_blocking_clients[to]
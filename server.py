@@ -38,29 +38,57 @@ class Server(Process):
     super(Server, self).__init__()
     self._info = info
     self._connection_stub = connection_stub
+    self._logger = server_logger.bind(server_name=info.name)
 
   def handle_client(self, client_sock: socket.socket, addr: socket.AddressInfo):
-    _logger = server_logger.bind(server_name=self._info.name)
+    _logger = self._logger
+    # Requests marked `concurrent` come from a multiplexing peer; they are served
+    # by the worker pool and replies are written whole under this lock. Everything
+    # else is served inline, in order, as before.
+    send_lock = threading.Lock()
     try:
       while True:
-        _logger.debug(f"Connected with {addr}")
+        _logger.debug("Connected with {}", addr)
         err_code, request = recv_message(client_sock)
 
         if request is None:
           _logger.critical(f"{STATUS_CODE[err_code]}")
           sr = JsonMessage(msg={"error_msg": STATUS_CODE[err_code], "error_code": err_code})
+          with send_lock:
+            client_sock.sendall(sr.serialize())
         else:
-          _logger.debug(f"Received message from {addr}: {request}")
-          sr = self._process_req(request)
-        if sr is not None:
-          _logger.debug(f"Sending message to {addr}: {sr}")
-          client_sock.sendall(sr.serialize())
+          _logger.debug("Received message from {}: {}", addr, request)
+          if request.get("concurrent"):
+            self._request_pool.submit(self._serve_request, client_sock, send_lock, addr, request)
+          else:
+            self._serve_request(client_sock, send_lock, addr, request)
     except Exception as e:
       _logger.exception(e)
     finally:
       _logger.debug(f"Something went wrong! Closing the socket")
       client_sock.close()
 
+  def _serve_request(self, client_sock: socket.socket, send_lock: threading.Lock,
+                     addr: socket.AddressInfo, request: JsonMessage) -> None:
+    _logger = self._logger
+    # Read the id first: handlers may forward (and re-tag) the request downstream
+    req_id = request.get("req_id")
+    try:
+      sr = self._process_req(request)
+    except Exception as e:
+      _logger.exception(e)
+      sr = JsonMessage({"status": "Internal error", "error_msg": str(e)})
+    if sr is None:
+      return
+    _logger.debug("Sending message to {}: {}", addr, sr)
+    # Responses may be shared templates, so the id is added on the wire only
+    frame = sr.serialize(req_id)
+    try:
+      with send_lock:
+        client_sock.sendall(frame)
+    except OSError as e:
+      _logger.debug(f"Could not reply to {addr}: {e}")
+
   def run(self) -> None:
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -69,8 +97,9 @@ class Server(Process):
 
     sleep(1)    # Let all servers start listening
     self._connection_stub.initalize_connections()
+    self._request_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix=f"worker#{self._info.name}")
 
-    _logger = server_logger.bind(server_name=self._info.name)
+    _logger = self._logger
 
     _logger.info(f"Listening on {self._info.host}:{self._info.port}")
 
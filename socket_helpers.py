@@ -1,6 +1,5 @@
 import struct
 from typing import Optional
-import json
 
 from core.message import JsonMessage
 from core.logger import network_logger
@@ -45,4 +44,4 @@ def recv_message(sock) -> tuple[int, Optional[JsonMessage]]:
         network_logger.critical(data, msglen)
         return MESSAGE_BODY_INVALID, None
 
-    return MESSAGE_VALID, JsonMessage(json.loads(data.decode("utf-8")))
+    return MESSAGE_VALID, JsonMessage.deserialize(data)